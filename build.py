@@ -10,7 +10,11 @@ Cloudflare SpeedTest 多平台打包工具
 import sys
 import io
 import os
+import concurrent.futures
+import functools
+import hashlib
 import platform
+import shutil
 import subprocess
 
 # 修复 Windows 控制台中文编码
@@ -18,20 +22,36 @@ if sys.platform == 'win32':
     sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
     sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
 
+# 目录扫描缓存：一次 scandir 批量拿到所有文件名，避免逐个 stat
+_dir_entries_cache = {}
+
+def _dir_entries(path):
+    """列出目录下所有条目名（同一进程内缓存结果）"""
+    if path not in _dir_entries_cache:
+        _dir_entries_cache[path] = {e.name for e in os.scandir(path)}
+    return _dir_entries_cache[path]
+
 def check_necessary_files():
     """检查必要文件是否存在"""
-    if not os.path.exists("cloudflare_speedtest.py"):
+    entries = _dir_entries(".")
+    if "cloudflare_speedtest.py" not in entries:
         print("❌ 错误：未找到主脚本 'cloudflare_speedtest.py'")
         return False
-    if not os.path.exists("requirements.txt"):
+    if "requirements.txt" not in entries:
         print("⚠️ 警告：未找到 'requirements.txt'，将跳过项目依赖安装")
     return True
 
+# 同一进程内只安装一次系统依赖
+_system_deps_installed = False
+
 def install_system_dependencies(is_static=False):
     """安装系统级依赖（仅在 Linux/macOS 且静态打包时需要）"""
+    global _system_deps_installed
     if not is_static:
         return True  # 普通打包无需额外系统依赖
-    
+    if _system_deps_installed:
+        return True  # 本进程已安装过，直接跳过
+
     system = platform.system().lower()
     if system != 'linux':
         print("⚠️ 静态打包仅支持 Linux 环境，将跳过系统依赖安装")
@@ -39,82 +59,133 @@ def install_system_dependencies(is_static=False):
     
     print("\n正在安装静态打包所需系统依赖...")
     try:
-        # 判断包管理器（apt 或 apk）
-        if os.path.exists("/etc/apt"):
+        # 判断包管理器（apt 或 apk），一次 scandir 覆盖两个探测
+        etc = _dir_entries("/etc")
+        if "apt" in etc:
+            # 注意：不能把 "&&" 当参数传给 check_call，必须拆成两次调用
+            subprocess.check_call(["sudo", "apt-get", "update", "-qq"])
             subprocess.check_call([
-                "sudo", "apt", "update",
-                "&&", "sudo", "apt", "install", "-y",
-                "build-essential", "zlib1g-dev", "openssl-dev", "musl-dev"
+                "sudo", "DEBIAN_FRONTEND=noninteractive",
+                "apt-get", "install", "-y", "--no-install-recommends",
+                "build-essential", "zlib1g-dev", "libssl-dev", "musl-dev"
             ])
-        elif os.path.exists("/etc/apk"):
+        elif "apk" in etc:
             subprocess.check_call([
                 "apk", "add", "--no-cache",
                 "build-base", "zlib-dev", "openssl-dev", "musl-dev"
             ])
         print("✓ 系统依赖安装完成")
+        _system_deps_installed = True
         return True
     except subprocess.CalledProcessError as e:
         print(f"✗ 系统依赖安装失败: {e}")
         return False
 
+def _deps_marker():
+    """计算当前依赖状态指纹（requirements.txt 内容 + 解释器版本）"""
+    if os.path.exists("requirements.txt"):
+        with open("requirements.txt", "rb") as f:
+            requirements = f.read()
+    else:
+        requirements = b""
+    return hashlib.sha256(
+        requirements + sys.version.encode() + b"pyinstaller"
+    ).hexdigest()
+
 def install_python_dependencies(is_static=False):
     """安装 Python 依赖（含 PyInstaller）"""
+    # 依赖指纹未变则直接跳过 pip（省去启动 + 解析器的数秒开销）
+    marker_path = os.path.join(".build_cache", "deps.marker")
+    marker = _deps_marker()
+    if os.path.exists(marker_path):
+        with open(marker_path, "r", encoding="utf-8") as f:
+            if f.read().strip() == marker:
+                print("\n✓ 依赖已是最新，跳过安装")
+                return True
+
     print("\n正在安装 Python 依赖...")
     try:
-        # 升级 pip
-        subprocess.check_call([sys.executable, "-m", "pip", "install", "--upgrade", "pip"])
-        
-        # 安装 PyInstaller
-        subprocess.check_call([sys.executable, "-m", "pip", "install", "pyinstaller"])
-        
-        # 安装项目依赖（如果有 requirements.txt）
+        # 一次 pip 调用装完所有依赖：省去多次 pip 启动开销，
+        # 并让 pip 内部并发下载 wheel、复用 HTTP 连接
+        cmd = [
+            sys.executable, "-m", "pip", "install",
+            "--upgrade", "--prefer-binary",
+            "pip", "pyinstaller"
+        ]
         if os.path.exists("requirements.txt"):
-            subprocess.check_call([sys.executable, "-m", "pip", "install", "-r", "requirements.txt"])
-        
+            cmd.extend(["-r", "requirements.txt"])
+
+        # 固定 pip 缓存目录（CI 可在运行之间保存/恢复 .pipcache/，
+        # 命中缓存时可完全跳过网络下载）
+        cache_dir = os.environ.get("PIP_CACHE_DIR", os.path.abspath(".pipcache"))
+        cmd.extend(["--cache-dir", cache_dir])
+
+        env = {
+            **os.environ,
+            "PIP_CACHE_DIR": cache_dir,            # 持久化 wheel/HTTP 缓存
+            "PIP_DISABLE_PIP_VERSION_CHECK": "1",  # 跳过版本检查的网络请求
+            "PIP_NO_INPUT": "1",                   # 非交互模式
+        }
+        subprocess.check_call(cmd, env=env)
+
+        # 安装成功后记录指纹，下次无变化时直接跳过
+        os.makedirs(".build_cache", exist_ok=True)
+        with open(marker_path, "w", encoding="utf-8") as f:
+            f.write(marker)
+
         print("✓ Python 依赖安装完成")
         return True
     except subprocess.CalledProcessError as e:
         print(f"✗ Python 依赖安装失败: {e}")
         return False
 
+# 系统映射
+OS_MAP = {
+    "darwin": "macos",
+    "linux": "linux",
+    "windows": "windows"
+}
+
+# 架构映射
+ARCH_MAP = {
+    "x86_64": "amd64",
+    "amd64": "amd64",
+    "x64": "amd64",
+    "arm64": "arm64",
+    "aarch64": "arm64",
+    "armv7l": "armhf",
+    "armv8l": "armhf"
+}
+
+@functools.lru_cache(maxsize=1)
 def get_platform_info():
-    """获取当前平台和架构信息"""
-    system = platform.system().lower()
-    machine = platform.machine().lower()
-
-    # 系统映射
-    os_map = {
-        "darwin": "macos",
-        "linux": "linux",
-        "windows": "windows"
-    }
-
-    # 架构映射
-    arch_map = {
-        "x86_64": "amd64",
-        "amd64": "amd64",
-        "x64": "amd64",
-        "arm64": "arm64",
-        "aarch64": "arm64",
-        "armv7l": "armhf",
-        "armv8l": "armhf"
-    }
-
-    return os_map.get(system, system), arch_map.get(machine, machine)
-
-def build_executable(is_static=False):
-    """执行打包（支持普通打包和静态打包）"""
+    """获取当前平台和架构信息（结果缓存，平台在进程内不会变）"""
+    if hasattr(os, "uname"):
+        # POSIX：一次 uname 系统调用同时拿到系统名和架构
+        u = os.uname()
+        system, machine = u.sysname.lower(), u.machine.lower()
+    else:
+        # Windows 没有 os.uname，退回 platform 模块
+        system = platform.system().lower()
+        machine = platform.machine().lower()
+
+    return OS_MAP.get(system, system), ARCH_MAP.get(machine, machine)
+
+def build_executable(is_static=False, output_name=None, fast=False):
+    """执行打包（支持普通打包和静态打包，可指定输出名用于多目标并行）"""
     os_name, arch = get_platform_info()
-    
+
     # 静态打包强制命名（用于 OpenWRT 识别）
     if is_static:
-        output_name = f"CloudflareSpeedTest-linux-arm64-static"
+        if output_name is None:
+            output_name = "CloudflareSpeedTest-linux-arm64-static"
         print(f"\n" + "="*60)
         print(f"开始静态打包 Linux ARM64 版本（OpenWRT 兼容）")
         print(f"输出文件名: {output_name}")
         print("="*60)
     else:
-        output_name = f"CloudflareSpeedTest-{os_name}-{arch}"
+        if output_name is None:
+            output_name = f"CloudflareSpeedTest-{os_name}-{arch}"
         print(f"\n" + "="*60)
         print(f"开始打包 {os_name}-{arch} 版本")
         print(f"输出文件名: {output_name}")
@@ -125,37 +196,62 @@ def build_executable(is_static=False):
         "pyinstaller",
         "--onefile",                    # 单文件打包
         "--name", output_name,          # 输出文件名
-        "--clean",                      # 清理临时文件
         "--noconfirm",                  # 自动覆盖
         "--strip",                      # 去除调试符号（Linux/macOS）
         "--optimize", "2",              # 代码优化级别
         "--console",                    # 控制台程序
-        # 隐藏导入（确保依赖被打包）
-        "--hidden-import", "requests",
-        "--hidden-import", "urllib3",
-        "--hidden-import", "certifi",
-        "--hidden-import", "charset_normalizer",
-        "--hidden-import", "idna",
-        # 排除不必要的模块
+        # 不再显式 --hidden-import requests 等：主脚本顶层 import requests，
+        # PyInstaller 会自动发现整条依赖链，显式声明只会重复分析
+        # 排除不必要的模块（每排除一个就少走一棵依赖子树）
         "--exclude-module", "tkinter",
         "--exclude-module", "matplotlib",
         "--exclude-module", "numpy",
         "--exclude-module", "pandas",
         "--exclude-module", "PIL",
         "--exclude-module", "cv2",
+        "--exclude-module", "test",
+        "--exclude-module", "unittest",
+        "--exclude-module", "pydoc",
+        "--exclude-module", "pydoc_data",
+        "--exclude-module", "doctest",
+        "--exclude-module", "distutils",
+        "--exclude-module", "setuptools",
+        "--exclude-module", "_pytest",
+        # 每个目标独立工作目录，并行打包时互不干扰
+        "--distpath", "dist",
+        "--workpath", f"build/{output_name}",
         "cloudflare_speedtest.py"       # 主脚本
     ]
 
+    # 开发迭代模式：跳过 UPX 压缩（纯 CPU 开销，每次可省数秒）
+    if fast:
+        cmd.append("--noupx")
+
     # 静态打包额外参数（仅 Linux ARM64）
     if is_static:
         cmd.extend([
-            "--target-architecture", "arm64",  # 指定 ARM64 架构
-            "--distpath", "dist",              # 输出目录
-            "--workpath", "build"              # 工作目录
+            "--target-architecture", "arm64"   # 指定 ARM64 架构
         ])
 
     try:
-        subprocess.check_call(cmd)
+        # 预编译主脚本为 .pyc（-b 写在源码旁边），PyInstaller 的
+        # modulegraph 会优先拿现成字节码，跳过每次打包的编译步骤；
+        # -OO 与下面的 --optimize 2 对应（去掉 docstring/assert）
+        env = {k: v for k, v in os.environ.items() if k != "PYTHONDONTWRITEBYTECODE"}
+        subprocess.check_call(
+            [sys.executable, "-OO", "-m", "compileall", "-b", "-q",
+             "cloudflare_speedtest.py"],
+            env=env
+        )
+
+        # 进程内直接调用 PyInstaller，省去一次解释器冷启动和重复 import；
+        # 延迟导入：PyInstaller 在 install_python_dependencies 之后才保证可用
+        import PyInstaller.__main__
+        try:
+            PyInstaller.__main__.run(cmd[1:])  # 去掉开头的 "pyinstaller"
+        except SystemExit as e:
+            if e.code:
+                raise subprocess.CalledProcessError(e.code, cmd)
         print(f"\n" + "="*60)
         print(f"✓ 打包成功！可执行文件位置: dist/{output_name}")
         print("="*60)
@@ -164,29 +260,77 @@ def build_executable(is_static=False):
         print(f"\n✗ 打包失败: {e}")
         return False
 
+def build_all(targets, fast=False):
+    """并行打包多个目标（每个目标一个子进程，工作目录互相隔离）"""
+    print(f"\n并行打包 {len(targets)} 个目标: {', '.join(targets)}")
+    max_workers = min(len(targets), os.cpu_count() or 1)
+    results = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            pool.submit(
+                build_executable,
+                is_static=target.endswith("-static"),
+                output_name=f"CloudflareSpeedTest-{target}",
+                fast=fast
+            ): target
+            for target in targets
+        }
+        for future in concurrent.futures.as_completed(futures):
+            results[futures[future]] = future.result()
+
+    failed = [target for target, ok in results.items() if not ok]
+    if failed:
+        print(f"\n✗ 以下目标打包失败: {', '.join(failed)}")
+        return False
+    return True
+
 def main():
-    """主函数（支持 --static 参数触发静态打包）"""
+    """主函数（支持 --static 静态打包、--all/--targets 多目标并行打包）"""
     print("="*60)
     print("Cloudflare SpeedTest 多平台打包工具")
     print("="*60)
 
-    # 解析命令行参数（是否静态打包）
+    # 解析命令行参数（是否静态打包；--fast 跳过 UPX，供开发迭代使用）
     is_static = "--static" in sys.argv
+    fast = "--fast" in sys.argv
+
+    # 多目标模式：--all 打本机目标 + 静态目标；--targets 指定逗号分隔列表
+    targets = None
+    if "--all" in sys.argv:
+        os_name, arch = get_platform_info()
+        targets = [f"{os_name}-{arch}"]
+        if os_name == "linux":
+            targets.append("linux-arm64-static")
+    elif "--targets" in sys.argv:
+        idx = sys.argv.index("--targets")
+        if idx + 1 >= len(sys.argv):
+            print("❌ 错误：--targets 需要逗号分隔的目标列表（如 linux-amd64,linux-arm64-static）")
+            sys.exit(1)
+        targets = [t for t in sys.argv[idx + 1].split(",") if t]
+
+    # --rebuild：清空 build/ 强制全量打包；默认保留以复用 PyInstaller 分析缓存
+    if "--rebuild" in sys.argv:
+        print("\n--rebuild：清理 build/ 目录，执行全量打包")
+        shutil.rmtree("build", ignore_errors=True)
 
     # 1. 检查必要文件
     if not check_necessary_files():
         sys.exit(1)
 
     # 2. 安装系统依赖（仅静态打包需要）
-    if is_static and not install_system_dependencies(is_static=True):
+    need_static = is_static or bool(targets and any(t.endswith("-static") for t in targets))
+    if need_static and not install_system_dependencies(is_static=True):
         sys.exit(1)
 
-    # 3. 安装 Python 依赖
+    # 3. 安装 Python 依赖（多目标模式下也只装一次，避免 N 个 pip 抢缓存）
     if not install_python_dependencies(is_static=is_static):
         sys.exit(1)
 
     # 4. 执行打包
-    if not build_executable(is_static=is_static):
+    if targets is not None:
+        if not build_all(targets, fast=fast):
+            sys.exit(1)
+    elif not build_executable(is_static=is_static, fast=fast):
         sys.exit(1)
 
     print("\n🎉 所有打包任务完成！")
@@ -0,0 +1,15 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+OpenWRT 静态打包入口（等价于 python build.py --static）
+所有打包逻辑统一放在 build.py，此文件只是薄封装，避免两份脚本漂移。
+"""
+
+import sys
+
+from build import main
+
+if __name__ == "__main__":
+    if "--static" not in sys.argv:
+        sys.argv.append("--static")
+    main()